@@ -1,15 +1,41 @@
 from google.cloud import firestore
-import random, logging
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.api_core.client_options import ClientOptions
+import asyncio, random, logging, time
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_TTL = 900  # seconds before cached collection reads are re-streamed
+BATCH_OP_LIMIT = 450  # stay safely under Firestore's 500 ops per batch
+
+# Shared Firestore client so multiple handlers reuse one gRPC channel.
+# Built lazily so importing this module never pays channel setup, and
+# with an explicit endpoint so discovery is skipped on first use.
+_SHARED_CLIENT = None
+
+def _get_client():
+    global _SHARED_CLIENT
+    if _SHARED_CLIENT is None:
+        _SHARED_CLIENT = firestore.Client(
+            client_options=ClientOptions(api_endpoint="firestore.googleapis.com")
+        )
+    return _SHARED_CLIENT
 
 
 class DatastoreHandler:
-    def __init__(self, log_item):
-        self.db = firestore.Client()  # Firestore client instance
+    def __init__(self, log_item, client=None):
+        self.db = client or _get_client()  # Firestore client instance
         self.log_item = log_item
         self.message_kind = "messages"  # Collection for messages
         self.userdata_kind = "userdata"  # Collection for user data
 
+        # In-process caches to avoid re-streaming whole collections every poll
+        self._runtime_cache = None
+        self._runtime_cache_ts = 0
+        self._msg_ids_cache = None
+        self._msg_ids_set = None  # companion set for O(1) membership
+        self._msg_ids_cache_ts = 0
+
 
     # -------------------------
     # Helper Methods
@@ -26,6 +52,42 @@ class DatastoreHandler:
         else:
             self.log_item(error_message, logging.ERROR)
 
+
+    def _commit_chunked(self, ops):
+        """Commit (doc_ref, data, merge) ops in chunks under the batch op limit."""
+        batches = []
+        for start in range(0, len(ops), BATCH_OP_LIMIT):
+            batch = self.db.batch()
+            for doc_ref, data, merge in ops[start:start + BATCH_OP_LIMIT]:
+                batch.set(doc_ref, data, merge=merge)
+            batches.append(batch)
+
+        if len(batches) == 1:
+            batches[0].commit()
+            return
+
+        # Overlap chunk commits so large backfills pay max(RTT), not sum(RTT).
+        # result() re-raises a failed chunk so it reaches the caller's
+        # error handling instead of dying silently inside the pool
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(batch.commit) for batch in batches]
+            for future in futures:
+                future.result()
+
+
+    def _cache_new_msg_ids(self, msg_ids):
+        """Fold successfully committed IDs into the msg-ids cache.
+
+        The companion set keeps membership O(1); appending to the list
+        preserves what get_all_msg_ids hands out until the TTL restream.
+        """
+        if self._msg_ids_set is None:
+            return
+        for msg_id in msg_ids:
+            if msg_id not in self._msg_ids_set:
+                self._msg_ids_set.add(msg_id)
+                self._msg_ids_cache.append(msg_id)
+
     # -------------------------
     # Message Operations
     # -------------------------
@@ -47,15 +109,58 @@ class DatastoreHandler:
 
     def get_all_msg_ids(self):
         """Get all message IDs in the messages collection."""
+        if self._msg_ids_cache is not None and time.time() - self._msg_ids_cache_ts < CACHE_TTL:
+            return self._msg_ids_cache
+
         self.log_item("Getting all message IDs")
         try:
-            docs = self.db.collection(self.message_kind).stream()
-            return [doc.id for doc in docs]
+            self._msg_ids_cache = [doc.id for doc in self.iter_all_msg_ids()]
+            self._msg_ids_set = set(self._msg_ids_cache)
+            self._msg_ids_cache_ts = time.time()
+            return self._msg_ids_cache
         except Exception as e:
             self._log_error("Error retrieving message IDs", e)
             return []
 
 
+    def iter_all_msg_ids(self):
+        """Lazily yield message docs with an empty projection (IDs only)."""
+        # select([]) asks Firestore for no fields, so each doc is just its ID
+        return self.db.collection(self.message_kind).select([]).stream()
+
+
+    def count_messages(self):
+        """Count messages with a server-side aggregation instead of a stream."""
+        try:
+            # Billed as one read per 1000 index entries vs one read per doc
+            return self.db.collection(self.message_kind).count().get()[0][0].value
+        except Exception as e:
+            self._log_error("Error counting messages", e)
+            return 0
+
+
+    def has_messages_missing_runtime(self):
+        """Check whether any message still lacks a Runtime field.
+
+        Messages are written without a Runtime key (it merges in later),
+        and Firestore queries can't match an absent field — == None only
+        finds explicit nulls. So compare the collection count against the
+        count of docs that do have the field (!= filters only match
+        documents where the field exists); both are cheap aggregations.
+        """
+        try:
+            total = self.db.collection(self.message_kind).count().get()[0][0].value
+            with_runtime = (
+                self.db.collection(self.message_kind)
+                .where(filter=FieldFilter("Runtime", "!=", None))
+                .count().get()[0][0].value
+            )
+            return with_runtime < total
+        except Exception as e:
+            self._log_error("Error checking for messages missing runtime", e)
+            return False
+
+
     def get_msg_by_id(self, msg_id):
         """Retrieve a specific message by its ID."""
         if not msg_id:
@@ -75,6 +180,20 @@ class DatastoreHandler:
             return None
 
 
+    def get_msgs_by_ids(self, msg_ids):
+        """Retrieve multiple messages in one pipelined RPC instead of N gets."""
+        if not msg_ids:
+            return {}
+
+        self.log_item(f"Getting {len(msg_ids)} messages by ID")
+        try:
+            refs = [self._get_document_ref(self.message_kind, msg_id) for msg_id in msg_ids]
+            return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+        except Exception as e:
+            self._log_error("Error retrieving messages by IDs", e)
+            return {}
+
+
     def push_msg(self, message):
         """Update or replace a single message in Firestore."""
         msg_id = message.get("Id")
@@ -86,6 +205,7 @@ class DatastoreHandler:
         try:
             doc_ref = self._get_document_ref(self.message_kind, msg_id)
             doc_ref.set(message)  # Update or replace the document
+            self._cache_new_msg_ids([msg_id])
             self.log_item(f"Message ID {msg_id} successfully pushed.")
         except Exception as e:
             self._log_error(f"Error pushing message ID {msg_id}", e)
@@ -98,16 +218,20 @@ class DatastoreHandler:
             return
 
         self.log_item(f"Pushing {len(messages)} messages in batch.")
-        batch = self.db.batch()
         try:
+            ops = []
+            msg_ids = []
             for message in messages:
                 msg_id = message.get("Id")
                 if not msg_id:
                     self.log_item("Skipping message without 'Id'.")
                     continue
-                doc_ref = self._get_document_ref(self.message_kind, msg_id)
-                batch.set(doc_ref, message)  # Update or replace the document
-            batch.commit()
+                ops.append((self._get_document_ref(self.message_kind, msg_id), message, False))
+                msg_ids.append(msg_id)
+            self._commit_chunked(ops)
+            # Patch the cache only now, so a failed commit (which raises
+            # above) can't poison it for the TTL window
+            self._cache_new_msg_ids(msg_ids)
             self.log_item(f"Successfully pushed {len(messages)} messages.")
         except Exception as e:
             self._log_error("Error pushing batch messages", e)
@@ -125,50 +249,69 @@ class DatastoreHandler:
             return
 
         self.log_item(f"Pushing {len(userdata)} userdata in batch.")
-        batch = self.db.batch()
         try:
+            ops = []
             for username, user_details in userdata.items():
                 if not username:
                     self.log_item("Skipping user without a username.")
                     continue
-                
+
                 # Ensure user details contain the necessary fields
                 if not user_details.get("Name"):  # removed to handle deleted users # or not user_details.get("Url")
                     self.log_item(f"Skipping invalid user details for {username}.")
                     continue
-                
-                # Get the document reference using the username as the key
-                doc_ref = self._get_document_ref(self.userdata_kind, username)
-                
-                # Set the document with the user details
-                batch.set(doc_ref, user_details)
-
-            batch.commit()
+
+                # Keyed by username
+                ops.append((self._get_document_ref(self.userdata_kind, username), user_details, False))
+
+            self._commit_chunked(ops)
             self.log_item(f"Successfully pushed {len(userdata)} users.")
 
         except Exception as e:
             self._log_error("Error pushing batch user data", e)
 
+    # -------------------------
+    # Async Wrappers
+    # -------------------------
+    # Firestore calls are blocking; callers running on an asyncio event
+    # loop (e.g. the Discord bot) should use these to avoid stalling it.
+    async def push_batch_msgs_async(self, messages):
+        """Push a batch of messages without blocking the event loop."""
+        await asyncio.to_thread(self.push_batch_msgs, messages)
+
+
+    async def push_batch_user_data_async(self, userdata):
+        """Push batch user data without blocking the event loop."""
+        await asyncio.to_thread(self.push_batch_user_data, userdata)
+
+
+    async def push_batch_runtimes_async(self, runtimes):
+        """Push batch runtimes without blocking the event loop."""
+        await asyncio.to_thread(self.push_batch_runtimes, runtimes)
+
     # -------------------------
     # Runtime Operations
     # -------------------------
     def get_all_runtimes(self):
         """Fetch all runtimes and return in object of key=uuid(hash), value=runtime(float)"""
+        if self._runtime_cache is not None and time.time() - self._runtime_cache_ts < CACHE_TTL:
+            return self._runtime_cache
+
         try:
-            # Query all documents from the datastore kind
-            query = self.db.collection(self.message_kind).stream()
+            # Project only the Runtime field instead of pulling full documents
+            query = self.db.collection(self.message_kind).select(["Runtime"]).stream()
 
             # Create a dictionary of runtimes
             runtimes = {}
             for doc in query:
-                data = doc.to_dict()
-                key = doc.id  # The document ID acts as the key
-                runtime = data.get("Runtime")  # Fetch the 'Runtime' field
+                runtime = doc.to_dict().get("Runtime")
 
                 # Only add to the dictionary if runtime exists and is not None
                 if runtime is not None:
-                    runtimes[key] = runtime
+                    runtimes[doc.id] = runtime
 
+            self._runtime_cache = runtimes
+            self._runtime_cache_ts = time.time()
             return runtimes
         except Exception as e:
             self._log_error("Error fetching all runtimes", e)
@@ -183,7 +326,7 @@ class DatastoreHandler:
         self.log_item(f"Getting runtime for message {msg_id}")
         try:
             doc_ref = self._get_document_ref(self.message_kind, msg_id)
-            doc = doc_ref.get()
+            doc = doc_ref.get(field_paths=["Runtime"])
             if doc.exists:
                 # Fetch the 'Runtime' field specifically
                 runtime = doc.get("Runtime")
@@ -195,6 +338,24 @@ class DatastoreHandler:
             return None
 
 
+    def get_runtimes_for_msg_ids(self, msg_ids):
+        """Fetch runtimes for many messages in one RPC, Runtime field only."""
+        if not msg_ids:
+            return {}
+
+        self.log_item(f"Getting runtimes for {len(msg_ids)} messages")
+        try:
+            refs = [self._get_document_ref(self.message_kind, msg_id) for msg_id in msg_ids]
+            return {
+                doc.id: doc.to_dict().get("Runtime")
+                for doc in self.db.get_all(refs, field_paths=["Runtime"])
+                if doc.exists
+            }
+        except Exception as e:
+            self._log_error("Error retrieving runtimes by IDs", e)
+            return {}
+
+
     def add_runtime_to_message(self, runtime):
         """Add or update the 'Runtime' key in the corresponding message."""
         if not runtime or len(runtime) != 2:
@@ -217,6 +378,8 @@ class DatastoreHandler:
 
             # Update the document with the new runtime
             doc_ref.update({"Runtime": runtime_value})
+            if self._runtime_cache is not None:
+                self._runtime_cache[msg_id] = runtime_value
             self.log_item(f"Runtime {runtime_value} successfully added to message ID {msg_id}.")
         except Exception as e:
             self._log_error(f"Error adding runtime to message ID {msg_id}", e)
@@ -229,8 +392,9 @@ class DatastoreHandler:
             return
 
         self.log_item(f"Pushing {len(runtimes)} runtimes in batch.")
-        batch = self.db.batch()
         try:
+            ops = []
+            committed = []
             for runtime in runtimes:
                 # Unpack runtime obj
                 msg_id = runtime.get("Id")
@@ -239,19 +403,17 @@ class DatastoreHandler:
                     self.log_item(f"Skipping runtime with missing msgId or runtime value")
                     continue
 
-                # Fetch the document reference
-                doc_ref = self._get_document_ref(self.message_kind, msg_id)
-                doc = doc_ref.get()
-
-                # Ensure the document exists
-                if not doc.exists:
-                    self.log_item(f"Message ID {msg_id} not found. Skipping.")
-                    continue
-
-                # Update the document with the new runtime
-                batch.update(doc_ref, {"Runtime": runtime_value})
-
-            batch.commit()
+                # Merge the runtime without reading the document first;
+                # set(merge=True) upserts safely if the message is missing
+                ops.append((self._get_document_ref(self.message_kind, msg_id), {"Runtime": runtime_value}, True))
+                committed.append((msg_id, runtime_value))
+
+            self._commit_chunked(ops)
+            # Patch the cache only now, so a failed commit (which raises
+            # above) can't poison it for the TTL window
+            if self._runtime_cache is not None:
+                for msg_id, runtime_value in committed:
+                    self._runtime_cache[msg_id] = runtime_value
             self.log_item(f"Successfully pushed runtimes for {len(runtimes)} messages.")
         except Exception as e:
             self._log_error("Error pushing batch runtimes", e)
@@ -317,11 +479,9 @@ def run_tests(datastore_handler):
         for i in range(1, 5)
     ]
     datastore_handler.push_batch_runtimes(batch_runtimes)
-    for runtime in batch_runtimes:
-        print(runtime)
-        msg_id = runtime[0]
-        msg_with_runtime = datastore_handler.get_msg_by_id(msg_id)
-        print(f"Message {msg_id} with runtime: {msg_with_runtime.get('Runtime')}")
+    runtimes_by_id = datastore_handler.get_runtimes_for_msg_ids([runtime[0] for runtime in batch_runtimes])
+    for msg_id, runtime_value in runtimes_by_id.items():
+        print(f"Message {msg_id} with runtime: {runtime_value}")
 
     print("\nTests completed.")
 
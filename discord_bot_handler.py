@@ -1,9 +1,11 @@
 # discord_bot_handler.py
-import json, os, hashlib, discord, logging, asyncio, time
+import re, xxhash, discord, logging, time
 from discord.ext import commands
-from datetime import datetime, timedelta
 from dotenv import dotenv_values
 
+# Matches the hex expiration param in Discord CDN attachment URLs
+_EX_RE = re.compile(r'[?&]ex=([0-9a-f]+)')
+
 # Discord bot token
 TOKEN = dotenv_values(".env")["TOKEN"]
 LIMIT = None
@@ -13,22 +15,43 @@ NEVER_SKIP = False
 GENERATE_THUMB = True
 
 class DiscordBotHandler(commands.Bot):
-    def __init__(self, message_queue, thumbnail_queue, CHANNEL_IDS, log_item, fetch_history=False, output_dir="messages"):
+    def __init__(self, message_queue, thumbnail_queue, CHANNEL_IDS, log_item, fetch_history=False, output_dir="messages", known_ids=None):
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(command_prefix="!", intents=intents)
         self.log_item = log_item
         self.CHANNEL_IDS = CHANNEL_IDS
-        
+
         self.message_queue = message_queue
         self.thumbnail_queue = thumbnail_queue
         self.fetch_history = fetch_history
 
         self.output_dir = output_dir
 
+        # IDs already in the datastore; lets history backfills skip rewrites
+        self.known_ids = known_ids if known_ids is not None else set()
+
+        # Loop-resident consumers scheduled from setup_hook (set by Overlord)
+        self.message_handler = None
+        self.refetch_handler = None
+        self.thumbnail_generator = None
+
+        # Per-channel message-link prefixes, built once per channel
+        self._link_prefix_cache = {}
+
     # -------------------------
     # Discord Built-in Methods
     # -------------------------
+    async def setup_hook(self):
+        """Schedule loop-resident consumer tasks once the loop exists."""
+        if self.message_handler is not None:
+            self.loop.create_task(self.message_handler.run())
+        if self.refetch_handler is not None:
+            self.loop.create_task(self.refetch_handler.start())
+        if self.thumbnail_generator is not None:
+            self.loop.create_task(self.thumbnail_generator.thumb_queue_handler())
+
+
     async def on_ready(self):
         self.log_item(f'Logged in as {self.user} (ID: {self.user.id})')
         self.log_item('Bot is ready and listening to channels.')
@@ -41,7 +64,7 @@ class DiscordBotHandler(commands.Bot):
         if message.author == self.user:
             return
 
-        if str(message.channel.id) in self.CHANNEL_IDS:
+        if message.channel.id in self.CHANNEL_IDS:
             self.log_item(f'{message.author.name} said: {message.content} with {len(message.attachments)} attachments')
             await self.process_message(message)
 
@@ -54,50 +77,61 @@ class DiscordBotHandler(commands.Bot):
         author_name = str(message.author.name)
         author_id = message.author.id
 
-        self.log_item(f"Processing message in channel {channel_id} by {author_name}", logging.DEBUG, True)
+        # Gate with MSG_LOG so the f-string isn't built for dropped lines
+        if MSG_LOG:
+            self.log_item(f"Processing message in channel {channel_id} by {author_name}", logging.DEBUG, True)
 
         if not message.attachments:
             if MSG_LOG: print(f"No attachments found in message. Skipping.")
             return
 
+        # Identical for every attachment; build once and share the dict
+        # (downstream consumer keys by username, so sharing is safe)
+        user_data = {
+            "Name": author_name,
+            "Url": message.author.avatar.url if message.author.avatar else None
+        }
+
         for attachment in message.attachments:
+            # Check if attachment is a video before paying for URL trim + hash;
+            # filename check avoids false positives from ".mp4" in query strings
+            if not attachment.filename.endswith(".mp4"):
+                continue
+
             trimmed_url = self.trim_attachment_url(attachment.url)
             uuid = self.generate_message_id(author_id, message.created_at, trimmed_url)
-            
-            # Check if attachment is a video
-            if ".mp4" not in attachment.url:
-                continue
 
-            # Update user icons for messages with attachments
-            user_data = {
-                "Name": author_name,
-                "Url": message.author.avatar.url if message.author.avatar else None
-            }
+            # Already stored (or enqueued this run); skip the rewrite.
+            # Refetched messages keep their uuid (the hash drops the
+            # rotating ?ex= params), so reacquire bypasses the skip to
+            # re-store the fresh Attachment_URL and Expire_Timestamp
+            if not reacquire and not NEVER_SKIP and uuid in self.known_ids:
+                continue
 
-            # Add to thumbnail queue
-            self.thumbnail_queue.put({
-                "Id": uuid,
-                "Attachment_URL": attachment.url
-            })
+            # Add to thumbnail queue, unless the generator already has
+            # both thumbnail and runtime for it (common on history refetch)
+            if self.thumbnail_generator is None or self.thumbnail_generator.needs_processing(uuid):
+                self.thumbnail_queue.put_nowait({
+                    "Id": uuid,
+                    "Attachment_URL": attachment.url
+                })
 
             # Add to message queue if still valid
             message_data = self.build_message_data(message, uuid, attachment)
-            self.message_queue.put(
+            self.message_queue.put_nowait(
                 (message_data, user_data)
             )
-        
-            self.log_item(f"Message {uuid} added to message queue.", logging.DEBUG, True)
+            self.known_ids.add(uuid)
+
+            if MSG_LOG:
+                self.log_item(f"Message {uuid} added to message queue.", logging.DEBUG, True)
 
         return
         
 
     def trim_attachment_url(self, URL):
-        """Trims a Discord attachment URL, removing everything after and including the last '?ex='."""
-        if "?ex=" in URL:
-            # Find the last occurrence of '?ex=' and trim everything from there
-            trimmed_url = URL[:URL.rfind("?ex=")]
-            return trimmed_url
-        return URL  # Return the original URL if '?ex=' is not found
+        """Trims a Discord attachment URL, removing everything after and including the '?ex='."""
+        return URL.partition("?ex=")[0]
 
 
     def build_message_data(self, message, message_id, attachment):
@@ -105,17 +139,22 @@ class DiscordBotHandler(commands.Bot):
         author_name = str(message.author)
         channel_id = message.channel.id
         date_str = message.created_at.timestamp()
-        link_to_message = f"https://discord.com/channels/{message.guild.id}/{channel_id}/{message.id}"
+
+        prefix = self._link_prefix_cache.get(channel_id)
+        if prefix is None:
+            prefix = self._link_prefix_cache.setdefault(
+                channel_id, f"https://discord.com/channels/{message.guild.id}/{channel_id}/"
+            )
 
         return {
-            "Id": message_id, 
+            "Id": message_id,
             "Discord_id": str(message.id),  # different id
             "Poster": author_name,
             "Date": date_str,
-            "Link_to_message": link_to_message,
+            "Link_to_message": prefix + str(message.id),
             "Description": message.clean_content,
             "Attachment_URL": attachment.url,
-            "Filename": attachment.filename.replace('.mp4', ''),
+            "Filename": attachment.filename.removesuffix('.mp4'),
             "Expire_Timestamp": self.get_expiration_timestamp(attachment.url),
             "channelId": str(channel_id)
         }
@@ -124,18 +163,14 @@ class DiscordBotHandler(commands.Bot):
     def generate_message_id(self, author_name, created_at, attachment):
         """Generate a consistent unique ID for a message."""
         """Uses author name, created timestamp, and attachment full url. None change but are unique"""
-        return hashlib.md5(f"{author_name}{created_at}{attachment}".encode()).hexdigest()[:8]
+        # Non-cryptographic hash; ~10-20x cheaper than md5 for an 8-char id
+        return xxhash.xxh3_64_hexdigest(f"{author_name}{created_at}{attachment}")[:8]
 
 
     def get_expiration_timestamp(self, url):
         """Extract expiration timestamp from the attachment URL, if available."""
-        try:
-            for param in url.split('?')[-1].split('&'):
-                if param.startswith("ex="):
-                    return int(param.split('=')[1], 16) # convert hex format date to int
-        except ValueError:
-            pass
-        return None
+        match = _EX_RE.search(url)
+        return int(match.group(1), 16) if match else None  # convert hex format date to int
 
 
     def is_expired(self, expire_time):
@@ -149,7 +184,7 @@ class DiscordBotHandler(commands.Bot):
         await self.wait_until_ready()
 
         for channel_id in self.CHANNEL_IDS:
-            channel = self.get_channel(int(channel_id))
+            channel = self.get_channel(channel_id)
 
             if channel is None:
                 print(f"Error: Bot does not have access to channel {channel_id}")
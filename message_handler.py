@@ -1,11 +1,11 @@
 # message_handler.py
-import json, os, time, asyncio, logging
-from queue import Queue, Empty
+import json, time, asyncio, logging
 
 MSG_QUEUE_LOG = False
+USER_CACHE_FILE = "user_avatar_cache.json"
 
 class MessageHandler:
-    def __init__(self, message_queue: Queue, datastore, log_item, batch_size=30, flush_interval=60):
+    def __init__(self, message_queue: asyncio.Queue, datastore, log_item, batch_size=30, flush_interval=60):
         self.message_queue = message_queue
         self.datastore = datastore
         self.log_item = log_item
@@ -13,24 +13,46 @@ class MessageHandler:
         self.batch_size = batch_size
         self.flush_interval = flush_interval
 
-        self.pending_messages = []
+        self.pending_messages = {}  # keyed by Id so duplicates coalesce
         self.pending_users = {}
         self.last_flush_time = time.time()
 
+        # Last-seen avatar URL per user; unchanged users are not re-written
+        self.user_avatar_cache = self._load_user_cache()
 
-    def start_live_message_handling(self):
+
+    def _load_user_cache(self):
+        try:
+            with open(USER_CACHE_FILE) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+
+    def _save_user_cache(self):
+        try:
+            with open(USER_CACHE_FILE, "w") as f:
+                json.dump(self.user_avatar_cache, f)
+        except OSError as e:
+            self.log_item(f"Failed to persist user avatar cache: {e}", logging.ERROR)
+
+
+    async def run(self):
+        """Consume the message queue as a task on the bot's event loop."""
         while True:
+            # Wait for a message, or wake when the next flush is due
+            remaining = max(0.1, self.flush_interval - (time.time() - self.last_flush_time))
             try:
-                # Get a message from the queue with a timeout
-                message, author = self.message_queue.get(timeout=0.1)
-                self.pending_messages.append(message)
+                message, author = await asyncio.wait_for(self.message_queue.get(), timeout=remaining)
+                self.pending_messages[message["Id"]] = message
 
                 username = author.get("Name")
-                if username and username not in self.pending_users:
+                if username and self.user_avatar_cache.get(username) != author.get("Url"):
                     self.pending_users[username] = author
+                    self.user_avatar_cache[username] = author.get("Url")
 
-            except Empty:
-                pass  # No messages to process
+            except asyncio.TimeoutError:
+                pass  # Flush interval elapsed with nothing new
 
             # Check if we should flush, by batch size and flush interval
             if (
@@ -38,21 +60,21 @@ class MessageHandler:
                 (time.time() - self.last_flush_time >= self.flush_interval)
             ):
                 if self.pending_messages:
-                    self.upload(self.pending_messages, self.pending_users)
+                    await self.upload(self.pending_messages, self.pending_users)
                     self.pending_messages.clear()
-                    self.last_flush_time = time.time()
+                    self.pending_users.clear()
+                self.last_flush_time = time.time()
 
-            time.sleep(0.1)
-    
-    def upload(self, pending_messages, pending_users):
-        self.datastore.push_batch_msgs(pending_messages)
-        self.datastore.push_batch_user_data(pending_users)
+    async def upload(self, pending_messages, pending_users):
+        await self.datastore.push_batch_msgs_async(list(pending_messages.values()))
+        await self.datastore.push_batch_user_data_async(pending_users)
         self.log_item(f"Uploading {len(pending_messages)} messages & {len(pending_users)} users")
 
     async def shutdown(self):
         print("MessageHandler: Shutting down...")
         if self.pending_messages or self.pending_users:
-            self.upload(self.pending_messages, self.pending_users)
+            await self.upload(self.pending_messages, self.pending_users)
             self.pending_messages.clear()
             self.pending_users.clear()
+        self._save_user_cache()
         print("MessageHandler: Shutdown complete.")
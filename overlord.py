@@ -1,7 +1,6 @@
 # overlord.py
-import threading, time, argparse, asyncio, traceback, logging, psutil
-from queue import Queue
-from datetime import datetime
+import os, threading, time, argparse, asyncio, traceback, logging, psutil
+from queue import SimpleQueue
 from message_handler import MessageHandler
 from thumbnail_gen import ThumbnailGenerator
 from uploader import JSONUploader, ThumbnailUploader
@@ -9,57 +8,81 @@ from discord_bot_handler import DiscordBotHandler
 from refetch_handler import RefetchHandler
 from datastore import DatastoreHandler
 
-from prometheus_client import Gauge, start_http_server
-
-# IDS For channels we want to gather from
-CHANNEL_IDS = [
-    "675233762900049930",   # Escape From Tarkov
-    "1188082042034983034",  # Warthunder
-    "679675078719569920",   # Other Games
-    "1180731401503506453",  # Lethal Company
-    "677367926176874509",   # Overwatch
-    "620814611137953812",   # Gaming Moments
-    "796860146382405642",   # For Honor
-    "1283675776780075058",  # Deadlock
-    "680162852199596045",   # Destiny
-    "869025643889819700",   # New World
-    "1091159481200689262",  # CSGO
-    "1205547794069463061",  # Helldivers
-    "946788298096001094",    # Elden Ring
-    "1040870367121657896",  # GMOD
-    "1314719992276713543",  # Rivals
-    "1309321497956974652",   # Path of exile
-    "1332196848252883004" # ARMA
-]
+from prometheus_client import CollectorRegistry, Gauge, start_http_server
+
+# IDS For channels we want to gather from; ints in a tuple so the hot
+# paths never re-parse decimal strings per message
+CHANNEL_IDS = (
+    675233762900049930,   # Escape From Tarkov
+    1188082042034983034,  # Warthunder
+    679675078719569920,   # Other Games
+    1180731401503506453,  # Lethal Company
+    677367926176874509,   # Overwatch
+    620814611137953812,   # Gaming Moments
+    796860146382405642,   # For Honor
+    1283675776780075058,  # Deadlock
+    680162852199596045,   # Destiny
+    869025643889819700,   # New World
+    1091159481200689262,  # CSGO
+    1205547794069463061,  # Helldivers
+    946788298096001094,   # Elden Ring
+    1040870367121657896,  # GMOD
+    1314719992276713543,  # Rivals
+    1309321497956974652,  # Path of exile
+    1332196848252883004   # ARMA
+)
 
 LOG_VERBOSE = True
+LOG_LEVEL = logging.DEBUG if LOG_VERBOSE else logging.INFO
 
 class Overlord:
     def __init__(self, fetch_history=False):
         self.running = True  # Control flag for graceful shutdown
-        # Queues for handling data flow
-        self.message_queue = Queue()
-        self.thumbnail_queue = Queue()
-        self.refetch_queue = Queue()
-
-        # Prometheus metrics
-        self.overlord_uptime = Gauge('overlord_uptime_seconds', 'Uptime of the Overlord process in seconds')
-        self.queue_sizes = Gauge('overlord_queue_size', 'Size of queues', ['queue_name'])
-        self.thread_status = Gauge('overlord_thread_status', 'Status of threads (1=alive, 0=dead)', ['thread_name'])
-        self.thread_cpu_time = Gauge('overlord_thread_cpu_time_seconds', 'CPU time used by threads in seconds', ['thread_name'])
-        self.total_memory_usage = Gauge('overlord_total_memory_percent', 'Total memory usage as a percentage of available resources')
-        self.total_cpu_usage = Gauge('overlord_total_cpu_percent', 'Total CPU usage as a percentage of available resources')
+        # Queues for handling data flow; every producer and consumer now
+        # lives on the bot's event loop, so plain asyncio.Queues give
+        # wakeup-on-put semantics with no locks or polling
+        self.message_queue = asyncio.Queue()
+        self.thumbnail_queue = asyncio.Queue()
+        self.refetch_queue = asyncio.Queue()
+
+        # Prometheus metrics on a dedicated registry; the global default
+        # registry drags in the process/GC collectors, which every scrape
+        # would re-collect and serialize alongside our handful of gauges
+        self.metrics_registry = CollectorRegistry()
+        self.overlord_uptime = Gauge('overlord_uptime_seconds', 'Uptime of the Overlord process in seconds', registry=self.metrics_registry)
+        self.queue_sizes = Gauge('overlord_queue_size', 'Size of queues', ['queue_name'], registry=self.metrics_registry)
+        self.thread_status = Gauge('overlord_thread_status', 'Status of threads (1=alive, 0=dead)', ['thread_name'], registry=self.metrics_registry)
+        self.thread_cpu_time = Gauge('overlord_thread_cpu_time_seconds', 'CPU time used by threads in seconds', ['thread_name'], registry=self.metrics_registry)
+        self.total_memory_usage = Gauge('overlord_total_memory_percent', 'Total memory usage as a percentage of available resources', registry=self.metrics_registry)
+        self.total_cpu_usage = Gauge('overlord_total_cpu_percent', 'Total CPU usage as a percentage of available resources', registry=self.metrics_registry)
+
+        # Pre-resolved label children so the monitor loop skips the
+        # kwargs-hash lookup inside .labels() on every tick
+        self._queue_gauges = {
+            name: self.queue_sizes.labels(queue_name=name)
+            for name in ("message_queue", "thumbnail_queue", "refetch_queue")
+        }
+        self._thread_gauges = {}
 
         # Handlers for each task
         # self.json_uploader = JSONUploader(log_item=log_item)
         self.datastore = DatastoreHandler(log_item=log_item)
         self.thumbnail_uploader = ThumbnailUploader(log_item=log_item)
-        self.discord_bot_handler = DiscordBotHandler(self.message_queue, self.thumbnail_queue, CHANNEL_IDS, log_item=log_item, fetch_history=fetch_history)
+        known_ids = set(self.datastore.get_all_msg_ids())
+        self.discord_bot_handler = DiscordBotHandler(self.message_queue, self.thumbnail_queue, CHANNEL_IDS, log_item=log_item, fetch_history=fetch_history, known_ids=known_ids)
         self.refetch_handler = RefetchHandler(self.discord_bot_handler, self.refetch_queue, self.datastore, log_item=log_item, fetch_history=fetch_history)
         self.message_handler = MessageHandler(self.message_queue, self.datastore, log_item=log_item)
         self.thumbnail_generator = ThumbnailGenerator(self.thumbnail_queue, self.datastore, self.thumbnail_uploader, log_item=log_item)
 
+        # These handlers run as tasks on the bot's loop
+        self.discord_bot_handler.message_handler = self.message_handler
+        self.discord_bot_handler.refetch_handler = self.refetch_handler
+        self.discord_bot_handler.thumbnail_generator = self.thumbnail_generator
+
         self.process = psutil.Process()
+        # (rebuild_time, {thread_id: pthread}) snapshot of process.threads();
+        # each rebuild is a syscall per OS thread, so it's rate-limited
+        self._threads_cache = (0.0, {})
 
     def start_threads(self, test_mode=None):
         """Start threads with optional test mode for individual threads."""
@@ -76,37 +99,26 @@ class Overlord:
             discord_bot_thread.start()
             threads.append(discord_bot_thread)
 
-        # Message thread
-        if test_mode == "message_handler" or test_mode is None:
-            message_thread = threading.Thread(target=self.run_message_handler_loop, daemon=True, name="MessageHandlerThread")
-            message_thread.start()
-            threads.append(message_thread)
-
-        # Refetch thread
-        if test_mode == "refetch" or test_mode is None:
-            refetch_thread = threading.Thread(target=self.run_refetch_handler_loop, daemon=True, name="RefetchHandlerThread")
-            refetch_thread.start()
-            threads.append(refetch_thread)
-
-            if test_mode == "refetch":
-                # Run the bot and fetch one message per channel, simulate expired messages
-                refetch_test_thread = threading.Thread(target=self.run_refetch_test, daemon=True, name="RefetchTestThread")
-                refetch_test_thread.start()
-                threads.append(refetch_test_thread)
-                return threads
-
-        # Thumbnail thread
-        if test_mode == "thumbnail" or test_mode is None:
-            thumbnail_thread = threading.Thread(target=self.run_thumbnail_generation, daemon=True, name="ThumbnailThread")
-            thumbnail_thread.start()
-            threads.append(thumbnail_thread)
-            
-            if test_mode == "thumbnail":
-                # Run the thumbnail gen function to load thumbnail info into queue
-                refetch_test_thread = threading.Thread(target=self.run_thumbnail_test, daemon=True, name="ThumbTestThread")
-                refetch_test_thread.start()
-                threads.append(refetch_test_thread)
-                return threads
+        # Message handling runs as a coroutine on the bot's loop
+        # (scheduled in DiscordBotHandler.setup_hook)
+
+        # Refetch handling runs as a coroutine on the bot's loop
+        # (scheduled in DiscordBotHandler.setup_hook)
+        if test_mode == "refetch":
+            # Run the bot and fetch one message per channel, simulate expired messages
+            refetch_test_thread = threading.Thread(target=self.run_refetch_test, daemon=True, name="RefetchTestThread")
+            refetch_test_thread.start()
+            threads.append(refetch_test_thread)
+            return threads
+
+        # Thumbnail generation runs as a coroutine on the bot's loop
+        # (scheduled in DiscordBotHandler.setup_hook)
+        if test_mode == "thumbnail":
+            # Run the thumbnail gen function to load thumbnail info into queue
+            refetch_test_thread = threading.Thread(target=self.run_thumbnail_test, daemon=True, name="ThumbTestThread")
+            refetch_test_thread.start()
+            threads.append(refetch_test_thread)
+            return threads
 
         # Start the queue monitor
         # monitor_thread = threading.Thread(target=self.monitor_queues, daemon=True, name="QueueMonitorThread")
@@ -127,67 +139,65 @@ class Overlord:
                 break
 
 
-    def run_message_handler_loop(self):
-        """Run the live message handler."""
-        while self.running:
-            try:
-                self.message_handler.start_live_message_handling()
-            except Exception as e:
-                print_trace_back("MessageHandlerThread", e)
-                break
-
-
-    def run_refetch_handler_loop(self):
-        """Run the refetch handler."""
-        while self.running:
-            try:
-                self.refetch_handler.start()
-            except Exception as e:
-                print_trace_back("RefetchThread", e)
-                break
-
-
-    def run_thumbnail_generation(self):
-        """Run the thumbnail generator."""
-        try:
-            print("Overlord: Starting Thumbnail Generator.")
-            asyncio.run(self.thumbnail_generator.thumb_queue_handler())
-        except Exception as e:
-            print_trace_back("ThumbnailThread", e)
-
-
     def cleanup(self):
         """Perform cleanup tasks and terminate gracefully."""
         print("Overlord: Performing cleanup...")
         self.running = False
-        
+
+        # Flush pending message/user batches and persist the avatar cache
+        # before the daemon threads die with the process; shutdown must run
+        # on the bot's loop since the flush awaits the datastore wrappers
+        try:
+            loop = self.discord_bot_handler.loop
+            loop_running = loop.is_running()
+        except AttributeError:  # bot never started; loop is still a sentinel
+            loop_running = False
+        if loop_running:
+            try:
+                asyncio.run_coroutine_threadsafe(
+                    self.message_handler.shutdown(), loop
+                ).result(timeout=30)
+            except Exception as e:
+                print_trace_back("Overlord", e)
+        else:
+            # No loop to flush on; at least persist the avatar cache
+            self.message_handler._save_user_cache()
+
         # Join threads (if necessary) or allow daemon threads to stop
         time.sleep(1)  # Small delay to ensure threads notice the flag
         print("Overlord: Cleanup complete.")
 
 
-    def monitor_threads(self, threads):
-        """Monitor threads and update Prometheus metrics."""
-        while self.running:
-            for thread in threads:
-                # Update thread status
-                self.thread_status.labels(thread_name=thread.name).set(1 if thread.is_alive() else 0)
-
-                if not thread.is_alive():
-                    print(f"Thread {thread.name} stopped unexpectedly.")
-                    threads.remove(thread)
-            time.sleep(5)
+    def _thread_gauge_pair(self, thread_name):
+        """Return cached (status, cpu_time) gauge children for a thread."""
+        pair = self._thread_gauges.get(thread_name)
+        if pair is None:
+            pair = (
+                self.thread_status.labels(thread_name=thread_name),
+                self.thread_cpu_time.labels(thread_name=thread_name),
+            )
+            self._thread_gauges[thread_name] = pair
+        return pair
 
 
     def start_prometheus_server(self, port=8000):
         """Start Prometheus metrics server."""
-        start_http_server(port)
+        start_http_server(port, registry=self.metrics_registry)
         print(f"Prometheus metrics available at http://localhost:{port}/metrics")
 
 
     def monitor_metrics(self, threads):
         """Unified monitoring for Prometheus metrics."""
+        # Housekeeping only runs here, so let the OS scheduler favor the
+        # bot and handler threads; on Linux nice() applies per-thread
+        try:
+            os.nice(10)
+        except (OSError, AttributeError):
+            pass  # unprivileged re-nice refusal or non-POSIX platform
+
         start_time = time.time()
+        psutil.cpu_percent(interval=None)  # prime the non-blocking sampler
+        deadline = time.monotonic()
         while self.running:
             current_time = time.time()
 
@@ -195,23 +205,36 @@ class Overlord:
             self.overlord_uptime.set(current_time - start_time)
 
             # Update queue sizes
-            self.queue_sizes.labels(queue_name='message_queue').set(self.message_queue.qsize())
-            self.queue_sizes.labels(queue_name='thumbnail_queue').set(self.thumbnail_queue.qsize())
-            self.queue_sizes.labels(queue_name='refetch_queue').set(self.refetch_queue.qsize())
-
-            # Monitor thread statuses and resource usage
-            thread_info = self.process.threads()  # Get all thread stats
+            self._queue_gauges['message_queue'].set(self.message_queue.qsize())
+            self._queue_gauges['thumbnail_queue'].set(self.thumbnail_queue.qsize())
+            self._queue_gauges['refetch_queue'].set(self.refetch_queue.qsize())
+
+            # Monitor thread statuses and resource usage; dead threads are
+            # reported once and dropped from the tracked list.
+            # CPU times are monotonic, so a snapshot up to 10s old is still
+            # a valid floor — refresh it then rather than every tick
+            now = time.monotonic()
+            if now - self._threads_cache[0] > 10:
+                self._threads_cache = (now, {t.id: t for t in self.process.threads()})
+            tinfo_by_id = self._threads_cache[1]
+            any_dead = False
             for thread in threads:
-                thread_name = thread.name
-                self.thread_status.labels(thread_name=thread_name).set(1 if thread.is_alive() else 0)
+                status_gauge, cpu_gauge = self._thread_gauge_pair(thread.name)
+                alive = thread.is_alive()
+                status_gauge.set(1 if alive else 0)
 
-                if thread.is_alive():
+                if alive:
                     # Get thread-specific CPU time
-                    for t in thread_info:
-                        if t.id == thread.ident:  # Match thread ID
-                            cpu_time = t.user_time + t.system_time
-                            self.thread_cpu_time.labels(thread_name=thread_name).set(cpu_time)
-                            break  # Exit loop early when match is found
+                    t = tinfo_by_id.get(thread.ident)
+                    if t is not None:
+                        cpu_gauge.set(t.user_time + t.system_time)
+                else:
+                    print(f"Thread {thread.name} stopped unexpectedly.")
+                    any_dead = True
+
+            # Rebuild once instead of an O(N) remove per dead thread
+            if any_dead:
+                threads[:] = [t for t in threads if t.is_alive()]
 
             # Update total memory and CPU usage
             try:
@@ -219,14 +242,17 @@ class Overlord:
                 memory = psutil.virtual_memory()
                 self.total_memory_usage.set(memory.percent)
 
-                # System-wide CPU usage
-                cpu_percent = psutil.cpu_percent(interval=1)  # Use 1-second sampling for accuracy
-                self.total_cpu_usage.set(cpu_percent)
+                # System-wide CPU usage; interval=None uses the delta since
+                # the previous call instead of blocking this thread for 1s
+                self.total_cpu_usage.set(psutil.cpu_percent(interval=None))
 
             except Exception as e:
                 print_trace_back("Overlord", e)
 
-            time.sleep(3)  # Unified update interval (3 seconds)
+            # Deadline scheduling: sleep to the next absolute tick so the
+            # loop body's runtime doesn't drift the 3s scrape cadence
+            deadline += 3.0
+            time.sleep(max(0, deadline - time.monotonic()))
 
 
     def run(self, test_mode=None):
@@ -242,11 +268,8 @@ class Overlord:
             # Start all threads
             threads = self.start_threads(test_mode)
 
-            # Start metric and queue monitoring
+            # Start metric, queue, and thread monitoring
             self.monitor_metrics(threads)
-
-            # Start thread monitor
-            self.monitor_threads(threads)
         except KeyboardInterrupt:
             print("\nOverlord: KeyboardInterrupt detected. Shutting down...")
             self.cleanup()
@@ -281,6 +304,8 @@ class Overlord:
         try:
             self.thumbnail_generator.load_thumbnail_info(CHANNEL_IDS)
             print("Overlord: Thumbnail Data Loaded.")
+            # No bot loop in this test mode, so the handler gets its own
+            asyncio.run(self.thumbnail_generator.thumb_queue_handler())
         except Exception as e:
             print_trace_back("ThumbTestThread", e)
 
@@ -295,43 +320,50 @@ THREAD_COLOR_MAP = {
     "ThumbTestThread": "\033[91m"   # Red
 }
 DEFAULT_THREAD_COLOR = "\033[92m"  # Default to green
+RESET_COLOR = "\033[0m"
+
+# Colored "[LEVEL]" prefixes, built once instead of two dicts per call
+_LEVEL_PREFIX = {
+    logging.DEBUG: "\033[94m[DEBUG]\033[0m",      # Blue
+    logging.INFO: "\033[92m[INFO]\033[0m",        # Green
+    logging.WARNING: "\033[93m[WARNING]\033[0m",  # Yellow
+    logging.ERROR: "\033[91m[ERROR]\033[0m",      # Red
+    logging.CRITICAL: "\033[95m[CRITICAL]\033[0m" # Magenta
+}
 
-def log_item(message, level=logging.INFO, verbose=False):
-    """Log a message from a specific thread at the given logging level."""
-    if verbose and not LOG_VERBOSE:
-        return
+# Producers push raw records here; one listener thread owns stdout so hot
+# threads never contend on its lock or pay formatting cost
+_LOG_QUEUE = SimpleQueue()
+_LOG_QUEUE_MAX = 10_000  # drop new lines beyond this to bound memory
+
+def _log_listener():
+    """Format and print queued log records on a dedicated thread."""
+    while True:
+        level, thread_name, message, ts = _LOG_QUEUE.get()
+        current_time = time.strftime("[%Y-%m-%d %H:%M:%S]", time.localtime(ts))
 
-    thread_name = threading.current_thread().name
-    current_time = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+        # Get the precomputed prefix and the color for the origin thread
+        prefix = _LEVEL_PREFIX.get(level, _LEVEL_PREFIX[logging.INFO])
+        thread_color = THREAD_COLOR_MAP.get(thread_name, DEFAULT_THREAD_COLOR)
 
-    # ANSI color codes for log levels
-    level_colors = {
-        logging.DEBUG: "\033[94m",   # Blue
-        logging.INFO: "\033[92m",    # Green
-        logging.WARNING: "\033[93m",  # Yellow
-        logging.ERROR: "\033[91m",    # Red
-        logging.CRITICAL: "\033[95m"  # Magenta
-    }
-    reset_color = "\033[0m"
+        print(f"{current_time} {prefix} {thread_color}{thread_name}{RESET_COLOR}: {message}")
 
-    # Get the color for the current log level
-    level_color = level_colors.get(level, "\033[92m")  # Default to green for INFO
 
-    # Get the color for the current thread name
-    thread_color = THREAD_COLOR_MAP.get(thread_name, DEFAULT_THREAD_COLOR)
+def log_item(message, level=logging.INFO, verbose=False):
+    """Log a message from a specific thread at the given logging level."""
+    # Fast no-op before any formatting work when the line would be dropped
+    if level < LOG_LEVEL:
+        return
+    if verbose and not LOG_VERBOSE:
+        return
+    if _LOG_QUEUE.qsize() > _LOG_QUEUE_MAX:
+        return  # listener is overloaded; drop rather than grow unbounded
 
-    level_name = {
-        logging.DEBUG: "DEBUG",
-        logging.INFO: "INFO",
-        logging.WARNING: "WARNING",
-        logging.ERROR: "ERROR",
-        logging.CRITICAL: "CRITICAL"
-    }.get(level, "INFO")
+    _LOG_QUEUE.put((level, threading.current_thread().name, message, time.time()))
 
-    # Construct the log message with thread-specific and level-specific colors
-    log_message = f"{current_time} {level_color}[{level_name}]{reset_color} {thread_color}{thread_name}{reset_color}: {message}"
 
-    print(log_message)
+_log_listener_thread = threading.Thread(target=_log_listener, daemon=True, name="LogListenerThread")
+_log_listener_thread.start()
 
 def print_trace_back(thread_name, e):
     log_item(f"{thread_name}: Error - {e}", logging.CRITICAL)
@@ -341,7 +373,7 @@ def print_trace_back(thread_name, e):
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Run the Overlord with optional single-thread testing and history fetching.")
-    parser.add_argument("--test", choices=["discord_bot", "message_handler", "refetch", "thumbnail", "json_upload", "thumbnail_upload"],
+    parser.add_argument("--test", choices=["discord_bot", "refetch", "thumbnail", "json_upload", "thumbnail_upload"],
                         help="Run a specific thread for testing purposes.")
     parser.add_argument("--fetch-history", action="store_true", help="Start message history fetching.")
     args = parser.parse_args()
@@ -1,121 +1,172 @@
 # refetch_handler.py
 import time, heapq, asyncio, logging
-from datetime import datetime, timedelta
+from collections import defaultdict
 
-DEBUGGING_HEAP = True
+# Mirrors overlord.LOG_VERBOSE (importing it here would be circular).
+# When False, the verbose DEBUG lines below skip f-string formatting
+# and the log_item call entirely instead of being dropped downstream.
+DEBUG_ENABLED = True
 
 class RefetchHandler:
-    def __init__(self, bot, refetch_queue, datastore, log_item, check_interval=60, fetch_history=False):
+    def __init__(self, bot, refetch_queue, datastore, log_item, fetch_history=False):
         """
         :param bot: The Discord bot instance for message fetching.
         :param refetch_queue: Queue containing messages to be refetched.
-        :param check_interval: Time in seconds between heap checks (default 5 minutes).
         """
         self.bot = bot
         self.refetch_queue = refetch_queue
         self.datastore = datastore
-        self.refetch_heap = []  # Min-heap to track messages by expiration
-        self.check_interval = check_interval  # Time between checking for expired messages
+        # One expiration min-heap per channel; shards map onto Discord's
+        # per-channel rate-limit buckets so one busy channel can't stall
+        # refetches for the rest
+        self._heaps = defaultdict(list)
+        self._heap_events = {}  # per-channel wakeup for the channel worker
+        self._workers = {}
         self.log_item = log_item
         self.fetch_history = fetch_history
+        self._refetch_sem = None  # rate-limit gate, created lazily on the bot's loop
 
-    def start(self):
-        """Start monitoring the refetch queue and handling expired messages."""
+    async def start(self):
+        """Monitor the refetch queue and handle expired messages on the bot's loop."""
         self.log_item("Starting refetch monitoring.")
-        
-        # Populate the refetch queue from the datastore if fetch_history is False
+
+        # Seed the heap from the datastore if fetch_history is False;
+        # the Firestore stream is blocking, so it runs on a worker thread
         if not self.fetch_history:
-            self.populate_refetch_queue_from_datastore()
-        
-        print_sleeping = True
-        last_message_time = 0  # log the last time we received a message from the queue
+            await asyncio.to_thread(self._bulk_load_heap)
+
+        # Spawn a worker per channel seen at seed time; later enqueues for
+        # new channels spawn theirs lazily
+        for channel_id in list(self._heaps):
+            self._ensure_worker(channel_id)
 
         while True:
-            # Add new items from the queue into the heap
-            while not self.refetch_queue.empty():
-                last_message_time = time.time()
+            # Route incoming items onto their channel's heap and wake the
+            # worker so it can recompute its nearest expiry
+            expire_timestamp, message_id, discord_id, channel_id = await self.refetch_queue.get()
+            if isinstance(expire_timestamp, (int, float)):
+                heapq.heappush(self._heaps[channel_id], (expire_timestamp, message_id, discord_id, channel_id))
+                self._ensure_worker(channel_id)
+                self._heap_events[channel_id].set()
+            else:
+                self.log_item(f"Invalid timestamp for message {message_id}: {expire_timestamp}", logging.ERROR)
+
+
+    def _ensure_worker(self, channel_id):
+        """Create the drain task for a channel's heap the first time it's seen."""
+        if channel_id not in self._workers:
+            self._heap_events[channel_id] = asyncio.Event()
+            self._workers[channel_id] = self.bot.loop.create_task(self._channel_worker(channel_id))
+
+
+    async def _channel_worker(self, channel_id):
+        """Sleep until this channel's nearest expiry, then drain what's due."""
+        heap = self._heaps[channel_id]
+        event = self._heap_events[channel_id]
+        while True:
+            if not heap:
+                await event.wait()
+                event.clear()
+                continue
 
-                expire_timestamp, message_id, discord_id, channel_id = self.refetch_queue.get()
-                try:
-                    if isinstance(expire_timestamp, (int, float)):
-                        heapq.heappush(self.refetch_heap, (expire_timestamp, message_id, discord_id, channel_id))
-                    else:
-                        self.log_item(f"Invalid timestamp for message {message_id}: {expire_timestamp}", logging.ERROR)
-                except ValueError as e:
-                    self.log_item(f"Invalid expire timestamp for message {message_id}: {e}", logging.ERROR)
-                print_sleeping = True
-
-            # Check the heap for expired messages
-            if last_message_time + (5 * 60) < time.time():
-                self.process_expired_messages()
-
-            # Wait for the next check
-            if print_sleeping:
-                self.log_item(f"Sleeping for {self.check_interval} seconds.")
-                self.log_item(f"Refetch heap size: {len(self.refetch_heap)}", logging.DEBUG)
-                if self.refetch_heap:
-                    self.log_item(f"Lowest item {self.refetch_heap[0]}", logging.DEBUG)
-                    
-                print_sleeping = False
-            time.sleep(self.check_interval)
-
-
-    def populate_refetch_queue_from_datastore(self):
-        """Retrieve all messages from the datastore and add them to the refetch queue."""
+            timeout = max(0, heap[0][0] - time.time())
+            try:
+                # A new entry may carry an earlier expiry; wake and re-arm
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+                event.clear()
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            now = int(time.time())
+            batch = []
+            while heap and heap[0][0] <= now:
+                batch.append(heapq.heappop(heap))
+
+            if batch:
+                if DEBUG_ENABLED:
+                    self.log_item(f"Refetching {len(batch)} expired messages from channel {channel_id}.", logging.DEBUG)
+                await self._refetch_batch(batch)
+
+
+    def _bulk_load_heap(self):
+        """Build the expiration heap from the datastore in one heapify pass."""
         if not self.datastore:
             self.log_item("DatastoreHandler is not provided; skipping datastore population.", logging.WARNING)
             return
 
-        self.log_item("Populating refetch queue from datastore.")
+        self.log_item("Seeding refetch heap from datastore.")
         try:
             messages = self.datastore.get_all_messages()
-            self.log_item(f"Retrieved {len(messages)} messages for refetching.", logging.DEBUG)
+            if DEBUG_ENABLED:
+                self.log_item(f"Retrieved {len(messages)} messages for refetching.", logging.DEBUG)
 
+            # Build each channel's list directly and heapify once (O(N))
+            # rather than round-tripping entries through the queue
+            total = 0
             for message in messages:
                 expire_timestamp = message.get("Expire_Timestamp")  # Already a Unix timestamp
                 discord_id = message.get("Discord_id")
                 channel_id = message.get("channelId")
-                if expire_timestamp and discord_id and channel_id:
-                    self.refetch_queue.put((expire_timestamp, message["Id"], discord_id, channel_id))
-                    self.log_item(f"Added message {message['Id']} to refetch queue.", logging.DEBUG, True)
-                else:
+                if not (expire_timestamp and discord_id and channel_id):
                     self.log_item(f"Message {message.get('Id')} missing required fields, skipping.", logging.WARNING)
+                    continue
+
+                # Validate per message so one malformed doc (legacy string
+                # timestamps, test fixtures) skips, instead of aborting the
+                # whole seed via the outer except
+                if not isinstance(expire_timestamp, (int, float)):
+                    self.log_item(f"Invalid timestamp for message {message.get('Id')}: {expire_timestamp}", logging.WARNING)
+                    continue
+                try:
+                    # Datastore fields are strings; normalize to ints once
+                    # here so refetch_message never re-parses per fetch
+                    channel_id = int(channel_id)
+                    discord_id = int(discord_id)
+                except (TypeError, ValueError):
+                    self.log_item(f"Malformed ids for message {message.get('Id')}, skipping.", logging.WARNING)
+                    continue
+
+                self._heaps[channel_id].append((expire_timestamp, message["Id"], discord_id, channel_id))
+                total += 1
+
+            for heap in self._heaps.values():
+                heapq.heapify(heap)
+            if DEBUG_ENABLED:
+                self.log_item(f"Refetch heaps seeded with {total} messages across {len(self._heaps)} channels.", logging.DEBUG)
         except Exception as e:
-            self.log_item(f"Error populating refetch queue: {e}", logging.ERROR)
-
+            self.log_item(f"Error seeding refetch heap: {e}", logging.ERROR)
 
-    def process_expired_messages(self):
-        """Process all expired messages in the heap."""
-        now = int(time.time())
 
-        while self.refetch_heap and self.refetch_heap[0][0] <= now:
-            expiration_timestamp, message_id, discord_id, channel_id = heapq.heappop(self.refetch_heap)
-            self.log_item(f"Refetching expired message {message_id} from channel {channel_id}.", logging.DEBUG)
-            try:
-                future = asyncio.run_coroutine_threadsafe(
-                    self.refetch_message(discord_id, channel_id), self.bot.loop
-                )
-                future.add_done_callback(
-                    lambda f: self.log_item(f"Result for {message_id}: {f.result()}", logging.DEBUG)
-                )
-            except Exception as e:
-                self.log_item(f"Failed to refetch message ID {message_id} in channel {channel_id}: {e}", logging.ERROR)
-            
-            time.sleep(1) # sleep for a second to avoid rate limiting
+    async def _refetch_batch(self, batch):
+        """Run a burst of refetches concurrently; the semaphore caps fan-out."""
+        await asyncio.gather(
+            *(self.refetch_message(discord_id, channel_id) for _, _, discord_id, channel_id in batch),
+            return_exceptions=True,
+        )
 
 
     async def refetch_message(self, discord_id, channel_id):
         """Refetch a specific message by Discord ID and channel."""
+        if self._refetch_sem is None:
+            self._refetch_sem = asyncio.Semaphore(5)
+
         try:
-            self.log_item(f"Attempting to refetch message ID {discord_id} from channel {channel_id}.", logging.DEBUG)
-            channel = self.bot.get_channel(int(channel_id))
-            if not channel:
-                self.log_item(f"Channel {channel_id} not found.", logging.ERROR)
-                return
-
-            # Fetch the message
-            message = await channel.fetch_message(int(discord_id))
-            # Process the message as needed (e.g., log, save, or enqueue for another task)
-            return await self.bot.process_message(message)  # Ensure this is an async-safe method
+            # Rate limiting happens here, where the Discord requests are
+            # actually issued: up to 5 fetches in flight, lightly smoothed
+            async with self._refetch_sem:
+                if DEBUG_ENABLED:
+                    self.log_item(f"Attempting to refetch message ID {discord_id} from channel {channel_id}.", logging.DEBUG)
+                channel = self.bot.get_channel(channel_id)
+                if not channel:
+                    self.log_item(f"Channel {channel_id} not found.", logging.ERROR)
+                    return
+
+                # Fetch the message
+                message = await channel.fetch_message(discord_id)
+                await asyncio.sleep(0.2)  # smooth the request rate inside the gate
+                # Reacquire: the uuid is unchanged, so skip the known_ids
+                # gate and re-store the fresh URL and expiry
+                return await self.bot.process_message(message, reacquire=True)
         except Exception as e:
             self.log_item(f"Error refetching message {discord_id}: {e}", logging.ERROR)
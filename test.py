@@ -1,23 +1,25 @@
 import requests
-import subprocess, os, json, time
+import os, struct, time
 import ffmpeg
 
+# Shared session so repeated clips reuse one TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+})
+
 def download_video(url, filename, byte_range=None):
     """
     Download a partial MP4 file for testing.
-    
+
     Args:
         url (str): The URL of the MP4 file.
         filename (str): The name of the file to save the content.
         byte_range (str): The byte range to download (e.g., "0-4096").
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    }
-    if byte_range:
-        headers["Range"] = f"bytes={byte_range}"
+    headers = {"Range": f"bytes={byte_range}"} if byte_range else {}
 
-    response = requests.get(url, headers=headers, stream=True)
+    response = _SESSION.get(url, headers=headers, stream=True)
 
     if response.status_code == 206:  # Partial content success
         with open(filename, "wb") as f:
@@ -30,11 +32,65 @@ def download_video(url, filename, byte_range=None):
     else:
         print(f"Failed to download file. HTTP Status: {response.status_code}")
 
-def get_video_length_with_ffprobe(video_filename):
-    """Get video duration using ffprobe."""
+def _read_remote_box_header(url, offset):
+    """Fetch one 16-byte box header via a Range request."""
+    data = _SESSION.get(url, headers={"Range": f"bytes={offset}-{offset + 15}"}).content
+    size, box_type = struct.unpack_from(">I4s", data, 0)
+    if size == 1:  # 64-bit extended size
+        size = struct.unpack_from(">Q", data, 8)[0]
+    return size, box_type
+
+def find_moov_range(url):
+    """Walk top-level box headers with tiny Range requests to locate moov.
+
+    Discord-hosted MP4s often keep moov at the END of the file, so grabbing
+    a speculative leading chunk misses it; this costs a handful of 16-byte
+    reads instead (there are only a few top-level boxes).
+    """
+    head = _SESSION.head(url)
+    total = int(head.headers.get("Content-Length", 0))
+
+    offset = 0
+    while offset + 8 <= total:
+        size, box_type = _read_remote_box_header(url, offset)
+        if box_type == b"moov":
+            return offset, size
+        if size <= 0:
+            break
+        offset += size
+    return None
+
+def download_moov(url, filename):
+    """Download exactly the moov atom rather than a speculative byte range."""
+    moov = find_moov_range(url)
+    if moov is None:
+        print("Error: moov atom not found.")
+        return
+
+    offset, size = moov
+    response = _SESSION.get(url, headers={"Range": f"bytes={offset}-{offset + size - 1}"})
+    with open(filename, "wb") as f:
+        f.write(response.content)
+    print(f"moov atom ({size} bytes at offset {offset}) downloaded to {filename}")
+
+def _iter_boxes(data, start, end):
+    """Walk MP4 boxes between start and end, yielding (type, body_start, box_end)."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:  # 64-bit extended size
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:  # box extends to end of data
+            size = end - offset
+        yield box_type, offset + header, offset + size
+        offset += size
+
+def get_video_length(video_filename):
+    """Read duration from the MP4 moov/mvhd atom in-process, no ffprobe fork."""
     try:
         abs_path = os.path.abspath(video_filename)
-        ffprobe_path = "./ffprobe.exe"  # Replace with your actual ffprobe path
 
         # Ensure the video file exists
         if not os.path.exists(abs_path):
@@ -42,37 +98,39 @@ def get_video_length_with_ffprobe(video_filename):
 
         start_time = time.time()
 
-        # Run ffprobe to extract metadata
-        result = subprocess.run(
-            [
-                ffprobe_path,
-                "-v", "quiet",               # Suppress unnecessary output
-                "-print_format", "json",     # Format output as JSON
-                "-show_format", abs_path     # Show only the format metadata
-            ],
-            stdout=subprocess.PIPE,          # Capture standard output
-            stderr=subprocess.PIPE,          # Capture standard error
-            text=True                        # Decode output as a string
-        )
+        with open(abs_path, "rb") as f:
+            data = f.read()
+
+        duration = None
+        for box_type, body_start, box_end in _iter_boxes(data, 0, len(data)):
+            if box_type != b"moov":
+                continue
+            for inner_type, inner_start, _ in _iter_boxes(data, body_start, box_end):
+                if inner_type == b"mvhd":
+                    version = data[inner_start]
+                    if version == 1:  # 64-bit timestamps
+                        timescale, dur = struct.unpack_from(">IQ", data, inner_start + 20)
+                    else:
+                        timescale, dur = struct.unpack_from(">II", data, inner_start + 12)
+                    duration = dur / timescale
+                    break
+            break
 
         end_time = time.time()
         execution_time = end_time - start_time
 
-        # Parse the JSON output
-        metadata = json.loads(result.stdout)
-        duration = float(metadata["format"]["duration"])  # Extract duration in seconds
+        if duration is None:
+            print("Error: moov/mvhd atom not found.")
+            return None
 
-        print(f"ffprobe execution time: {execution_time:.4f} seconds")
+        print(f"mvhd parse execution time: {execution_time:.4f} seconds")
         return duration
 
     except FileNotFoundError as e:
         print(f"Error: {e}")
         return None
-    except KeyError:
-        print("Error: Duration not found in ffprobe output.")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON output: {e}")
+    except struct.error:
+        print("Error: Malformed MP4 box structure.")
         return None
     except Exception as e:
         print(f"Unexpected error: {e}")
@@ -99,7 +157,7 @@ def generate_thumbnail(video_filename, thumbnail_path):
 
 # Example usage
 file_path = "./jacob_hurt_locker.mp4"
-duration = get_video_length_with_ffprobe(file_path)
+duration = get_video_length(file_path)
 generate_thumbnail(file_path, file_path + ".png")
 
 if duration is not None:
@@ -1,53 +1,212 @@
 # thumbnail_gen.py
-import os, ffmpeg, aiohttp, asyncio, logging
-from queue import Queue
-from datetime import datetime
-import time, subprocess, json
-from collections import defaultdict
+import ffmpeg, aiohttp, asyncio, logging
+import re, time, struct, subprocess
+from concurrent.futures import wait as futures_wait
+
+# "Duration: HH:MM:SS.ss" banner line on ffmpeg's stderr
+_DURATION_RE = re.compile(rb"Duration:\s*(\d+):(\d{2}):(\d{2}\.\d+)")
+
+
+def _parse_ffmpeg_duration(stderr):
+    """Pull the container duration (seconds) out of ffmpeg stderr output."""
+    match = _DURATION_RE.search(stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    return None
+
+
+def _iter_boxes(data, start, end):
+    """Walk MP4 boxes between start and end, yielding (type, body_start, box_end)."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:  # 64-bit extended size
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:  # box extends to end of data
+            size = end - offset
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+class _RuntimeCache:
+    """Lazy dict-like view of stored runtimes.
+
+    Replaces the eager get_all_runtimes() warmup, whose memory and
+    startup cost grew with the whole corpus; ids are fetched from the
+    datastore on first touch and memoized, including confirmed misses.
+
+    The blocking Firestore read only happens in get(); loop-resident
+    callers resolve misses through get_async(), and `in` answers from
+    memoized state alone so it can never stall the event loop.
+    """
+
+    def __init__(self, datastore):
+        self._datastore = datastore
+        self._known = {}      # id -> runtime
+        self._missing = set() # ids confirmed absent upstream
+
+    def get(self, video_id):
+        """Fetch a runtime, hitting the datastore on a miss. Blocking."""
+        if video_id in self._known:
+            return self._known[video_id]
+        if video_id in self._missing:
+            return None
+
+        runtime = self._datastore.get_runtime_for_msg_id(video_id)
+        if runtime is None:
+            self._missing.add(video_id)
+        else:
+            self._known[video_id] = runtime
+        return runtime
+
+    async def get_async(self, video_id):
+        """Like get(), but the miss RPC runs on a worker thread."""
+        if video_id in self._known:
+            return self._known[video_id]
+        if video_id in self._missing:
+            return None
+        return await asyncio.to_thread(self.get, video_id)
+
+    def __contains__(self, video_id):
+        # Memoized state only — no RPC; ids the cache hasn't resolved yet
+        # report absent and get settled via get_async off the loop
+        return video_id in self._known
+
+    def __setitem__(self, video_id, runtime):
+        self._known[video_id] = runtime
+        self._missing.discard(video_id)
+
+
+def _detect_hwaccel():
+    """Pick the first usable hardware decoder from `ffmpeg -hwaccels`."""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-hwaccels"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        available = result.stdout.decode().split()
+        for accel in ("cuda", "vaapi", "qsv"):
+            if accel in available:
+                return accel
+    except Exception:
+        pass
+    return None
+
+
+def _parse_mp4_duration(data):
+    """Read duration from the moov/mvhd atom; None if absent or malformed."""
+    try:
+        for box_type, body_start, box_end in _iter_boxes(data, 0, len(data)):
+            if box_type != b"moov":
+                continue
+            for inner_type, inner_start, _ in _iter_boxes(data, body_start, box_end):
+                if inner_type == b"mvhd":
+                    version = data[inner_start]
+                    if version == 1:  # 64-bit timestamps
+                        timescale, duration = struct.unpack_from(">IQ", data, inner_start + 20)
+                    else:
+                        timescale, duration = struct.unpack_from(">II", data, inner_start + 12)
+                    if timescale:
+                        return duration / timescale
+            break
+    except struct.error:
+        pass
+    return None
 
 class ThumbnailGenerator:
-    def __init__(self, thumbnail_queue: Queue, datastore, thumbnail_uploader, log_item, output_folder="thumb", temp_folder="temp"):
+    def __init__(self, thumbnail_queue: asyncio.Queue, datastore, thumbnail_uploader, log_item):
         self.thumbnail_queue = thumbnail_queue
         self.log_item = log_item
         self.datastore = datastore
         self.thumbnail_uploader = thumbnail_uploader
-        self.output_folder = output_folder
-        self.temp_folder = temp_folder
 
-        # Ensure output and temp directories exist
-        os.makedirs(self.output_folder, exist_ok=True)
-        os.makedirs(self.temp_folder, exist_ok=True)
+        self.metadata_queue = asyncio.Queue()
+        # The uploader already listed the bucket to seed its dedup set;
+        # derive our skip set from it instead of listing a second time
+        self.uploaded_uuids = {
+            name.rsplit('.', 1)[0] for name in self.thumbnail_uploader.last_uploaded_files
+        }
+        self.video_lengths = _RuntimeCache(self.datastore)
+
+        # Shared download session, created lazily on the event loop; reusing
+        # one pool amortizes TLS/DNS setup across every CDN download
+        self._session = None
+
+        # In-flight GCS uploads running on the uploader's worker pool
+        self._upload_futures = set()
+
+        # Probe once for a hardware decoder; None means software decode
+        self.hwaccel = _detect_hwaccel()
+        if self.hwaccel:
+            self.log_item(f"ThumbnailGenerator: Using {self.hwaccel} hardware decode.")
+
+        # Compiled ffmpeg argv per hwaccel variant; built on first use
+        self._thumb_args = {}
+
+    def needs_processing(self, video_id):
+        """True when the clip still needs a thumbnail or a runtime.
+
+        Checked at enqueue sites on the bot's hot ingest path, so it only
+        consults in-memory state (never an RPC): the thumbnail set first,
+        then the runtime cache's memoized entries. An unresolved runtime
+        enqueues the clip and the download stage settles it off the loop.
+        """
+        if video_id not in self.uploaded_uuids:
+            return True
+        return video_id not in self.video_lengths
+
+
+    async def _get_session(self):
+        """Return the shared ClientSession, creating it on first use."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=8,            # 2x the default thumbnail concurrency
+                    limit_per_host=4,   # everything goes to the Discord CDN
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                )
+            )
+        return self._session
 
-        self.metadata_queue = Queue()
-        self.uploaded_uuids = self.thumbnail_uploader.get_all_uuids()
-        self.video_lengths = self.datastore.get_all_runtimes()
+    async def thumb_queue_handler(self, download_workers=4, decode_workers=4):
+        """Run the download -> decode -> upload pipeline off the thumbnail queue.
 
-    async def thumb_queue_handler(self, max_concurrent_tasks=4):
-        """Continuously generate thumbnails from the queue with limited concurrency."""
+        Each stage has its own worker pool so clip N+2's download, clip
+        N+1's decode, and clip N's upload all overlap; wall time per clip
+        approaches the slowest stage instead of the sum of all three.
+        """
         self.log_item("ThumbnailGenerator: Initializing...")
-        semaphore = asyncio.Semaphore(max_concurrent_tasks)
-        pending_tasks = set()
 
         # Stats counters
         stats = {"generated": 0, "skipped": 0, "errors": 0}
 
+        # Bounded hand-off between stages: when decoders fall behind, the
+        # downloaders pause instead of buffering every clip in memory
+        decode_queue = asyncio.Queue(maxsize=decode_workers * 2)
+
         # Start metadata writer
         metadata_task = asyncio.create_task(self.batch_save_metadata())
 
-        try:
-            while True:
-                # Add new tasks from the queue
-                self.add_tasks_from_queue(semaphore, pending_tasks)
-
-                # Process completed tasks
-                if pending_tasks:
-                    await self.process_completed_tasks(pending_tasks, stats)
-                else:
-                    await asyncio.sleep(1)  # No pending tasks, prevent busy looping
+        workers = [
+            asyncio.create_task(self._download_worker(decode_queue, stats))
+            for _ in range(download_workers)
+        ] + [
+            asyncio.create_task(self._decode_worker(decode_queue, stats))
+            for _ in range(decode_workers)
+        ]
 
+        try:
+            await asyncio.gather(*workers)
         except Exception as e:
             self.log_item(f"Critical error in generate_thumbnails: {e}", logging.CRITICAL)
         finally:
+            for worker in workers:
+                worker.cancel()
             self.print_final_stats(stats)
             # Ensure metadata_task is properly handled
             metadata_task.cancel()
@@ -55,77 +214,193 @@ class ThumbnailGenerator:
                 await metadata_task
             except asyncio.CancelledError:
                 self.log_item("batch_save_metadata: Task cancelled.", logging.DEBUG)
+            # Let in-flight uploads land before tearing down
+            if self._upload_futures:
+                futures_wait(list(self._upload_futures), timeout=30)
+            if self._session is not None and not self._session.closed:
+                await self._session.close()
 
 
-    async def download_video(self, url, filename):
-        """Download video file from a URL."""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    with open(filename, "wb") as f:
-                        while True:
-                            chunk = await response.content.read(8192)
-                            if not chunk:
-                                break
-                            f.write(chunk)
+    async def _download_worker(self, decode_queue, stats):
+        """Stage 1: pull clips off the queue and fetch their bytes."""
+        while True:
+            video = await self.thumbnail_queue.get()
+            video_id = video["Id"]
+            try:
+                # Check if metadata or thumbnail already exists; the runtime
+                # lookup may hit Firestore, so it runs on a worker thread
+                # (and memoizes, so the loop-side checks below stay free)
+                metadata_exists = await self.video_lengths.get_async(video_id) is not None
+                thumbnail_exists = video_id in self.uploaded_uuids
+
+                if metadata_exists and thumbnail_exists:
+                    self.log_item(f"Metadata and thumbnail exist for {video_id}. Skipping.", logging.DEBUG, True)
+                    self.update_stats(stats, "skipped")
+                    continue
 
+                self.log_item(f"Downloading video for {video_id}.", logging.DEBUG, True)
+                video_bytes = await self.download_video(video["Attachment_URL"])
+                if not video_bytes:
+                    self.log_item(f"Download failed for {video_id}.", logging.ERROR)
+                    self.update_stats(stats, "error")
+                    continue
+
+                await decode_queue.put((video_id, video_bytes, metadata_exists, thumbnail_exists))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log_item(f"Error downloading video {video_id}: {e}", logging.ERROR)
+                self.update_stats(stats, "error")
 
-    def generate_thumbnail(self, video_filename, thumbnail_path):
-        """Generate a thumbnail using ffmpeg."""
-        try:
-            if not os.path.exists(video_filename):
-                self.log_item(f"Video file {video_filename} does not exist. Skipping thumbnail generation.", logging.ERROR)
-                return
 
-            (
+    async def _decode_worker(self, decode_queue, stats):
+        """Stage 2: decode thumbnails and hand results to metadata/upload."""
+        while True:
+            video_id, video_bytes, metadata_exists, thumbnail_exists = await decode_queue.get()
+            try:
+                # Generate thumbnail if missing; the same pass reports the
+                # container duration for the metadata step below
+                png_bytes = None
+                ffmpeg_duration = None
+                if not thumbnail_exists:
+                    self.log_item(f"Generating thumbnail {video_id}")
+                    png_bytes, ffmpeg_duration = await self.generate_thumbnail(video_id, video_bytes)
+                else:
+                    self.log_item(f"Thumbnail Exists {video_id}", logging.DEBUG, True)
+
+                # Generate metadata if missing
+                if not metadata_exists:
+                    await self.process_metadata(video_id, video_bytes, ffmpeg_duration)
+
+                # Stage 3 is the uploader's thread pool; submission never blocks
+                if png_bytes:
+                    self.upload_thumbnail(video_id, png_bytes)
+                    self.update_stats(stats, "generated")
+                elif not thumbnail_exists:
+                    self.update_stats(stats, "error")
+                else:
+                    self.update_stats(stats, "generated")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log_item(f"Error processing video {video_id}: {e}", logging.ERROR)
+                self.update_stats(stats, "error")
+
+
+    async def download_video(self, url):
+        """Download a video from a URL, returning its bytes (None on failure)."""
+        session = await self._get_session()
+        async with session.get(url) as response:
+            if response.status != 200:
+                self.log_item(f"Download returned HTTP {response.status} for {url}", logging.ERROR)
+                return None
+
+            # Clips are tens of MB at most; hold them in RAM instead of
+            # bouncing through temp/ just to re-read for ffmpeg. 1 MB
+            # chunks keep the Python-level loop to ~dozens of iterations
+            # per clip rather than thousands of 8 KB reads
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(1 << 20):
+                body.extend(chunk)
+            return bytes(body)
+
+
+    async def generate_thumbnail(self, video_id, video_bytes):
+        """Generate a thumbnail using ffmpeg, returning (png_bytes, duration).
+
+        The duration comes free from the same invocation's stderr banner,
+        so no separate ffprobe process is ever spawned.
+        """
+        # Try the hardware decoder first; some codecs (e.g. AV1 on older
+        # GPUs) have no hw decoder, so fall back to CPU per item
+        if self.hwaccel:
+            out, err, returncode = await self._run_thumbnail(video_bytes, self.hwaccel)
+            if returncode == 0 and out:
+                self.log_item(f"Thumbnail successfully generated for {video_id}.", logging.INFO)
+                return out, _parse_ffmpeg_duration(err)
+            self.log_item(
+                f"{self.hwaccel} decode failed for {video_id}; retrying on CPU: {err.decode(errors='replace')}",
+                logging.WARNING,
+            )
+
+        out, err, returncode = await self._run_thumbnail(video_bytes, None)
+        if returncode == 0 and out:
+            self.log_item(f"Thumbnail successfully generated for {video_id}.", logging.INFO)
+            return out, _parse_ffmpeg_duration(err)
+
+        self.log_item(f"Error generating thumbnail: {video_id}: {err.decode(errors='replace')}", logging.ERROR)
+        return None, _parse_ffmpeg_duration(err)
+
+
+    async def _run_thumbnail(self, video_bytes, hwaccel):
+        """Run one ffmpeg thumbnail pass; returns (stdout, stderr, returncode)."""
+        # Video in on stdin, PNG out on stdout; an asyncio subprocess means
+        # each in-flight ffmpeg is just fds on the loop, not a held
+        # executor thread blocked in ffmpeg.run
+        proc = await asyncio.create_subprocess_exec(
+            *self._thumbnail_args(hwaccel),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(video_bytes)
+        return out, err, proc.returncode
+
+
+    def _thumbnail_args(self, hwaccel):
+        """Return the compiled ffmpeg argv for a decode variant, cached."""
+        args = self._thumb_args.get(hwaccel)
+        if args is None:
+            # Input-side seek with keyframe-only decode: ffmpeg demuxes to
+            # the first I-frame and decodes just that, instead of decoding
+            # a whole GOP for the one frame we keep
+            input_kwargs = {"ss": 0, "skip_frame": "nokey", "noaccurate_seek": None}
+            if hwaccel:
+                # Decode on the GPU; the single scaled frame comes back to
+                # system memory, so the plain scale filter still applies
+                input_kwargs["hwaccel"] = hwaccel
+
+            # cache: spools stdin to a temp file as it's read, giving the
+            # mov demuxer the seekability it needs for moov-at-end clips
+            # (common for Discord-hosted MP4s; a bare pipe fails with
+            # "moov atom not found" on them)
+            stream = (
                 ffmpeg
-                .input(video_filename, ss=0)
+                .input("cache:pipe:0", **input_kwargs)
                 .filter("scale", 420, -1)
-                .output(thumbnail_path, vframes=1)
-                .global_args('-loglevel', 'error')  # Adjust logging verbosity for ffmpeg
-                .run(overwrite_output=True)
+                .output("pipe:", vframes=1, format="image2", vcodec="png")
+                # info level keeps the Duration banner on stderr, which
+                # doubles as the runtime probe
+                .global_args('-loglevel', 'info')
             )
-            self.log_item(f"Thumbnail successfully generated for {video_filename}.", logging.INFO)
+            args = ffmpeg.compile(stream)
+            self._thumb_args[hwaccel] = args
+        return args
 
-        except ffmpeg.Error as e:
-            self.log_item(f"Error generating thumbnail: {video_filename}: {e.stderr.decode() if e.stderr else str(e)}", logging.ERROR)
-        except Exception as e:
-            self.log_item(f"Unexpected error: {str(e)}", logging.ERROR)
 
-
-    def get_video_length(self, file_path):
-        """Get the length of a video file."""
-        try:
-            result = subprocess.run(
-                ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "format=duration", "-of", "csv=p=0", file_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            output = result.stdout.strip()
-            self.log_item(f"Metadata generated for {file_path}, Runtime: {output}", logging.DEBUG, True)
-            if output:
-                return float(output)
-            else:
-                self.log_item(f"Error getting video length: No duration found in ffprobe output for {file_path}", logging.ERROR)
-        except ValueError:
-            self.log_item(f"Error converting video length to float for {file_path}. Output: {output}", logging.ERROR)
-        except Exception as e:
-            self.log_item(f"Error getting video length for {file_path}: {e}", logging.ERROR)
-        return None
-    
-
-    async def batch_save_metadata(self):
-        """Periodically save metadata from the queue to runtime JSON."""
+    async def batch_save_metadata(self, batch_size=50, flush_interval=60):
+        """Batch runtime metadata and flush on size, oldest-entry age, or shutdown."""
         self.log_item("BATCH SAVE METADATA Started.")
-        changes_made = False
-        last_modification = time.time()
         new_metadata = []
+        first_enqueue_ts = None  # when the oldest unflushed entry arrived
+
+        try:
+            while True:
+                try:
+                    # Wait for the next entry, but never let the oldest
+                    # pending one sit past the flush interval — keyed to the
+                    # batch's first entry, not the last modification, so a
+                    # steady trickle can't defer the flush forever
+                    timeout = None
+                    if new_metadata:
+                        timeout = max(0, flush_interval - (time.time() - first_enqueue_ts))
+                    try:
+                        entry = await asyncio.wait_for(self.metadata_queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        await self._flush_metadata(new_metadata)
+                        first_enqueue_ts = None
+                        continue
 
-        while True:
-            try:
-                while not self.metadata_queue.empty():
-                    entry = self.metadata_queue.get(timeout=0.1)
                     video_id = entry.get("Id")
                     length = entry.get("Length")
 
@@ -133,49 +408,59 @@ class ThumbnailGenerator:
                         self.log_item(f"Invalid metadata entry skipped: {entry}", logging.ERROR)
                         continue
 
-                    # Avoid overwriting identical entries
-                    if video_id not in self.video_lengths:
-                        self.video_lengths[video_id] = length
-                        last_modification = time.time()
-                        changes_made = True
-                        new_metadata.append(entry)
-                        self.log_item(f"Metadata for {video_id}, length {length} added to batch to be uploaded", logging.DEBUG)
+                    # Producers dedupe against video_lengths before
+                    # enqueuing, so every entry here is new
+                    if not new_metadata:
+                        first_enqueue_ts = time.time()
+                    new_metadata.append(entry)
+                    self.log_item(f"Metadata for {video_id}, length {length} added to batch to be uploaded", logging.DEBUG)
+
+                    if len(new_metadata) >= batch_size:
+                        await self._flush_metadata(new_metadata)
+                        first_enqueue_ts = None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.log_item(f"Error in batch_save_metadata: {e}", logging.CRITICAL)
+        finally:
+            # Shutdown (task cancelled): push the final partial batch
+            await self._flush_metadata(new_metadata)
 
-                    elif self.video_lengths[video_id] != length:
-                        self.log_item(f"Conflicting metadata for {video_id}. Keeping existing value: {self.video_lengths[video_id]}. New: {length}", logging.WARNING)
-                    else:
-                        self.log_item(f"Metadata already exists and is stored, skipping", logging.WARNING)
-
-                # Save only if changes were made and, 30 changes are made, or 60 seconds have passed since last change 
-                if (changes_made and 
-                    (len(new_metadata) >= 50 or 
-                     time.time() - last_modification >= (60) # waiting for re-uploading runtimes
-                    )
-                ):
-                    # Upload runtime data
-                    self.log_item(f"Uploading Batch Runtimes {len(new_metadata)}")
-                    self.upload_runtime(new_metadata)
-                    new_metadata.clear()
-
-                    changes_made = False  # Reset flag after save
-
-                await asyncio.sleep(1)  # Delay before the next batch
-            except Exception as e:
-                self.log_item(f"Error in batch_save_metadata: {e}", logging.CRITICAL)
 
+    async def _flush_metadata(self, new_metadata):
+        """Upload and clear the pending metadata batch, if any."""
+        if not new_metadata:
+            return
+        self.log_item(f"Uploading Batch Runtimes {len(new_metadata)}")
+        # Hand the list off and clear before awaiting, so entries arriving
+        # during the upload start a fresh batch
+        batch = list(new_metadata)
+        new_metadata.clear()
+        await self.upload_runtime(batch)
 
-    async def process_metadata(self, video_id, temp_video_path):
+
+    async def process_metadata(self, video_id, video_bytes, ffmpeg_duration=None):
         """Process and generate video metadata."""
         try:
-            loop = asyncio.get_event_loop()
+            # A sibling coroutine may have handled this id while we were
+            # downloading; bail before doing any parse work
+            if video_id in self.video_lengths:
+                return
+
+            # The in-memory mvhd parse covers normal clips; the thumbnail
+            # pass's stderr Duration line covers the rest, so no extra
+            # process is ever spawned for the runtime
+            video_length = _parse_mp4_duration(video_bytes)
+            if video_length is None:
+                video_length = ffmpeg_duration
 
-            # Get video length
-            video_length = await loop.run_in_executor(None, self.get_video_length, temp_video_path)
             if video_length is not None:
                 self.log_item(f"Video length for {video_id}: {video_length:.2f} seconds", logging.DEBUG, True)
 
-                # Push metadata to the queue
-                self.metadata_queue.put({"Id": video_id, "Length": video_length})
+                # Register the length immediately so concurrent workers and
+                # the skip checks see it without a queue round-trip
+                self.video_lengths[video_id] = video_length
+                self.metadata_queue.put_nowait({"Id": video_id, "Length": video_length})
                 self.log_item(f"Added metadata to queue: {video_id}, Length: {video_length}", logging.DEBUG, True)
             else:
                 self.log_item(f"Unable to determine video length for {video_id}.", logging.ERROR)
@@ -183,90 +468,6 @@ class ThumbnailGenerator:
             self.log_item(f"Error processing metadata for {video_id}: {e}", logging.ERROR)
 
 
-    async def process_video(self, video):
-        """Process a single video and generate a thumbnail if needed."""
-        video_url = video["Attachment_URL"]
-        video_id = video["Id"]
-
-        temp_video_path = os.path.join(self.temp_folder, f"{video_id}.mp4")
-        thumbnail_path = os.path.join(self.output_folder, f"{video_id}.png")
-
-        try:
-            # Check if metadata or thumbnail already exists
-            metadata_exists = video_id in self.video_lengths
-            thumbnail_exists = video_id in self.uploaded_uuids
-
-            # print(f"Does metadata exist? {video_id} : {video_id in self.video_lengths}")
-            # if not video_id in self.video_lengths:
-            #     print(f"Double checking... Runtime?:{self.datastore.get_runtime_for_msg_id(video_id)}")
-
-            if metadata_exists and thumbnail_exists:
-                self.log_item(f"Metadata and thumbnail exist for {video_id}. Skipping.", logging.DEBUG, True)
-                return {"status": "skipped"}
-
-            # Download video if either element are missing
-            if not metadata_exists or not thumbnail_exists:
-                if not os.path.exists(temp_video_path):
-                    self.log_item(f"Downloading video for {video_id}.", logging.DEBUG, True)
-                    await self.download_video(video_url, temp_video_path)
-
-            # Generate metadata if missing
-            if not metadata_exists:
-                await self.process_metadata(video_id, temp_video_path)
-
-            # Generate thumbnail if missing
-            if not thumbnail_exists:
-                self.log_item(f"Generating thumbnail {video_id}")
-                await asyncio.get_event_loop().run_in_executor(None, self.generate_thumbnail, temp_video_path, thumbnail_path)
-            else:
-                self.log_item(f"Thumbnail Exists {video_id}", logging.DEBUG, True)
-
-            if os.path.exists(temp_video_path):
-                os.remove(temp_video_path)
-                self.log_item(f"Temporary file removed: {temp_video_path}", logging.DEBUG, True)
-
-            # Upload Thumbnail
-            self.upload_thumbnail(f"{video_id}.png")
-
-            return {"status": "generated"}
-
-        except Exception as e:
-            self.log_item(f"Error processing video {video_id}: {e}", logging.ERROR)
-            return {"status": "error"}
-
-
-    def add_tasks_from_queue(self, semaphore, pending_tasks):
-        """Add new tasks from the thumbnail queue to pending_tasks."""
-        while not self.thumbnail_queue.empty():
-            video = self.thumbnail_queue.get()
-            task = asyncio.create_task(self.process_with_semaphore(video, semaphore))
-            pending_tasks.add(task)
-            task.add_done_callback(pending_tasks.discard)
-
-
-    async def process_with_semaphore(self, video, semaphore):
-        """Wrapper to process a video with a semaphore."""
-        async with semaphore:
-            return await self.process_video(video)
-
-
-    async def process_completed_tasks(self, pending_tasks, stats):
-        """Process completed tasks and update stats."""
-        done, _ = await asyncio.wait(pending_tasks, return_when=asyncio.FIRST_COMPLETED)
-        for completed_task in done:
-            try:
-                task_result = completed_task.result()
-                if not task_result:  # Skip None results
-                    continue
-
-                # Update stats directly without adding metadata to the queue
-                self.update_stats(stats, task_result.get("status"))
-
-            except Exception as e:
-                self.log_item(f"Error handling completed task: {e}", logging.ERROR)
-                stats["errors"] += 1
-
-
     def update_stats(self, stats, status):
         """Update stats counters based on task status."""
         if status == "generated":
@@ -281,16 +482,30 @@ class ThumbnailGenerator:
         self.log_item(f"Thumbnails Generated: {stats['generated']}   Skipped: {stats['skipped']}   Errors: {stats['errors']}")
 
 
-    def upload_runtime(self, runtime_batch):
-        """Run the JSON upload"""
-        self.datastore.push_batch_runtimes(runtime_batch)
+    async def upload_runtime(self, runtime_batch):
+        """Push the runtime batch on a worker thread, off the event loop."""
+        await self.datastore.push_batch_runtimes_async(runtime_batch)
         
 
-    def upload_thumbnail(self, thumbnail_filename):
-        """Run the PNG Thumbnail Upload"""
-        try:
-            self.log_item(f"Starting {thumbnail_filename} Upload", logging.DEBUG, True)
-            self.thumbnail_uploader.upload_thumbnail(thumbnail_filename)
-            self.log_item(f"Finished {thumbnail_filename} Upload", logging.DEBUG, True)
-        except Exception as e:
-            self.log_item(f"Error uploading runtime_data.json: {e}", logging.ERROR)
+    def upload_thumbnail(self, video_id, png_bytes):
+        """Queue the PNG upload on the uploader's pool; doesn't block."""
+        self.log_item(f"Starting {video_id} Upload", logging.DEBUG, True)
+        # Mark done now so re-enqueues of the same clip (notably the daily
+        # refetch of expiring messages) skip the download and decode
+        # instead of redoing everything up to a deduped GCS PUT
+        self.uploaded_uuids.add(video_id)
+        future = self.thumbnail_uploader.submit_upload(video_id, png_bytes)
+        self._upload_futures.add(future)
+        future.add_done_callback(lambda f: self._upload_done(video_id, f))
+
+
+    def _upload_done(self, video_id, future):
+        """Reap a finished upload future and surface any error."""
+        self._upload_futures.discard(future)
+        exc = future.exception()
+        if exc is not None:
+            # Un-mark so a later enqueue can retry the upload
+            self.uploaded_uuids.discard(video_id)
+            self.log_item(f"Error uploading thumbnail {video_id}: {exc}", logging.ERROR)
+        else:
+            self.log_item(f"Finished {video_id} Upload", logging.DEBUG, True)
@@ -1,5 +1,6 @@
 # uploader.py
 from google.cloud import storage
+from concurrent.futures import ThreadPoolExecutor
 import os, logging
 from dotenv import dotenv_values
 
@@ -12,13 +13,25 @@ GOOGLE_APPLICATION_CREDENTIALS = env.get("GOOGLE_APPLICATION_CREDENTIALS")
 if GOOGLE_APPLICATION_CREDENTIALS:
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GOOGLE_APPLICATION_CREDENTIALS
 
+# One storage client for the process; each Client() pays credential and
+# metadata discovery, and every uploader talks to the same project
+_SHARED_CLIENT = None
+
+def _get_client():
+    """Return the shared storage client, creating it on first use."""
+    global _SHARED_CLIENT
+    if _SHARED_CLIENT is None:
+        _SHARED_CLIENT = storage.Client()
+    return _SHARED_CLIENT
+
 # DEPRECATED CLASS, use datastore
 class JSONUploader:
     def __init__(self, log_item, bucket_name=BUCKET_NAME, output_dir="messages"):
         self.log_item = log_item
         self.output_dir = output_dir
         self.bucket_name = bucket_name
-        self.storage_client = storage.Client()
+        # bucket() is a local handle, no network round-trip
+        self.bucket = _get_client().bucket(bucket_name)
 
     def upload_json_data(self, channel_id):
         """Uploads the JSON file for the given channel ID if it exists."""
@@ -46,8 +59,7 @@ class JSONUploader:
 
     def upload_to_bucket(self, file_path, destination_blob_name):
         """Uploads a file to the specified bucket, overwriting if it already exists."""
-        bucket = self.storage_client.bucket(self.bucket_name)
-        blob = bucket.blob(destination_blob_name)
+        blob = self.bucket.blob(destination_blob_name)
 
         blob.upload_from_filename(file_path)
         self.log_item(f"JSONUploader: Uploaded {file_path} to {destination_blob_name}")
@@ -58,37 +70,41 @@ class ThumbnailUploader:
         self.log_item = log_item
         self.thumbnail_dir = thumbnail_dir
         self.bucket_name = bucket_name
-        self.storage_client = storage.Client()
-        self.last_uploaded_files = set()
-
-    def upload_thumbnail(self, thumbnail_filename):
-        """Uploads new thumbnails to the Google Cloud bucket."""
-        filename = thumbnail_filename
+        # bucket() is a local handle, no network round-trip
+        self.bucket = _get_client().bucket(bucket_name)
+        # Seed the dedup set from the bucket so warm restarts never
+        # re-upload thumbnails that are already stored
+        self.last_uploaded_files = {f"{uuid}.png" for uuid in self.get_all_uuids()}
+        # Blob uploads are thread-safe on one client; a small pool keeps
+        # several latency-bound GCS round-trips in flight at once
+        self._exec = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ThumbUpload")
+
+    def submit_upload(self, uuid, data):
+        """Queue a thumbnail upload on the worker pool; returns a Future."""
+        return self._exec.submit(self.upload_thumbnail_bytes, uuid, data)
+
+    def upload_thumbnail_bytes(self, uuid, data):
+        """Uploads in-memory PNG bytes to the bucket, overwriting if it exists."""
+        filename = f"{uuid}.png"
+        if filename in self.last_uploaded_files:
+            return
 
-        if filename.endswith(".jpg") or filename.endswith(".png"):
-            file_path = os.path.join(self.thumbnail_dir, filename)
+        destination_blob_name = f"thumb/{filename}"
+        blob = self.bucket.blob(destination_blob_name)
 
-            if filename not in self.last_uploaded_files:
-                destination_blob_name = f"thumb/{filename}"
-                self.upload_to_bucket(file_path, destination_blob_name)
-                self.last_uploaded_files.add(filename)
-
-    def upload_to_bucket(self, file_path, destination_blob_name):
-        """Uploads a file to the specified bucket, overwriting if it already exists."""
-        bucket = self.storage_client.bucket(self.bucket_name)
-        blob = bucket.blob(destination_blob_name)
-
-        blob.upload_from_filename(file_path)
-        self.log_item(f"ThumbnailUploader: Uploaded {file_path} to {destination_blob_name}", logging.DEBUG, True)
+        blob.upload_from_string(data, content_type="image/png")
+        self.last_uploaded_files.add(filename)
+        self.log_item(f"ThumbnailUploader: Uploaded {filename} to {destination_blob_name}", logging.DEBUG, True)
 
     def get_all_uuids(self):
         """Get all of the uuids of the images in the subfolder thumb in the bucket"""
-        bucket = self.storage_client.get_bucket(self.bucket_name)
-
-        # List all blobs with the prefix 'thumb/'
-        blobs = bucket.list_blobs(prefix="thumb/")
-
-        # Extract the UUIDs by removing 'thumb/' prefix and the file extension
-        uuids = [blob.name[len("thumb/"):].rsplit('.', 1)[0] for blob in blobs]
+        # List all blobs with the prefix 'thumb/'; only names are needed,
+        # so trim each page's JSON down to them. The cached handle avoids
+        # get_bucket's metadata GET per call
+        blobs = self.bucket.list_blobs(prefix="thumb/", fields="items(name),nextPageToken")
+
+        # Extract the UUIDs by removing 'thumb/' prefix and the file
+        # extension; a set makes the per-video membership test O(1)
+        uuids = {blob.name[len("thumb/"):].rsplit('.', 1)[0] for blob in blobs}
 
         return uuids